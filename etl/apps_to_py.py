@@ -5,10 +5,15 @@ Provides `extract_all_workout_data(ws)` which scans a worksheet for all W#D# anc
 and returns a list of dicts representing each set entry.
 """
 import re
-from typing import List, Dict
+from collections import defaultdict
+from typing import List, Dict, Optional
 
-# Regex to identify week-day anchors like 'W7D1', case-insensitive
-week_day_regex = re.compile(r'^W\d+D\d+$', re.IGNORECASE)
+# Separator used to join a row's stripped cells into one string
+CELL_SEP = '\x1f'
+
+# Regex to find week-day anchors like 'W7D1', case-insensitive, as whole
+# cells of a CELL_SEP-joined row
+week_day_regex = re.compile(r'(?<![^\x1f])W[0-9]+D[0-9]+(?![^\x1f])', re.IGNORECASE)
 
 # Fixed column offsets relative to the "Exercise" column
 OFFSETS = {
@@ -20,20 +25,29 @@ OFFSETS = {
 }
 
 
-def extract_all_workout_data(ws) -> List[Dict]:
+def extract_all_workout_data(ws, values: Optional[List[List[str]]] = None,
+                             metadata: Optional[Dict] = None) -> List[Dict]:
     """
     Extracts all workout data from a Google Sheets worksheet `ws`,
     mirroring the Apps Script for each week-day anchor.
 
+    Args:
+        ws: the gspread worksheet to scan.
+        values: result of `ws.get_all_values()`, if the caller already has it.
+        metadata: result of `ws.spreadsheet.fetch_sheet_metadata()`, if the
+            caller already has it.
+
     Returns:
         A list of dicts with keys:
         - 'week_day', 'exercise', 'set_number',
         - 'prescribed_reps', 'prescribed_rpe',
         - 'completed_weight', 'completed_reps', 'completed_rpe',
         - 'notes'
+        Cell values are returned with surrounding whitespace stripped.
     """
-    # 1) Fetch merge metadata
-    metadata = ws.spreadsheet.fetch_sheet_metadata()
+    # 1) Fetch merge metadata (unless the caller passed it in)
+    if metadata is None:
+        metadata = ws.spreadsheet.fetch_sheet_metadata()
     sheet_meta = next(s for s in metadata['sheets']
                       if s['properties']['sheetId'] == ws.id)
     merges = sheet_meta.get('merges', [])
@@ -46,115 +60,122 @@ def extract_all_workout_data(ws) -> List[Dict]:
             'num_cols': m['endColumnIndex'] - m['startColumnIndex'],
         })
 
-    # 2) Fetch all cell values
-    values = ws.get_all_values()
+    # 2) Fetch all cell values (unless the caller passed them in)
+    if values is None:
+        values = ws.get_all_values()
+    # Strip every cell once up front; everything below works on stripped text
+    values = [[cell.strip() for cell in row] for row in values]
     results: List[Dict] = []
 
+    # Index the merges once so the per-anchor lookups below don't rescan them:
+    # each covered (row, col) -> its merge, merges by starting column, and
+    # merges by the text in their top-left cell.
+    cell_to_merge = {}
+    merges_by_col = defaultdict(list)
+    merges_by_label = defaultdict(list)
+    for mr in merge_ranges:
+        for r in range(mr['row'], mr['row'] + mr['num_rows']):
+            for c in range(mr['col'], mr['col'] + mr['num_cols']):
+                cell_to_merge.setdefault((r, c), mr)
+        merges_by_col[mr['col']].append(mr)
+        r_idx = mr['row'] - 1
+        c_idx = mr['col'] - 1
+        if r_idx < len(values) and c_idx < len(values[r_idx]):
+            merges_by_label[values[r_idx][c_idx]].append(mr)
+
+    # Header row -> {label: [column indexes]}, built on first use
+    header_cols = {}
+
     # 3) Find each W#D# anchor
     for i, row in enumerate(values):
-        for j, cell in enumerate(row):
-            if week_day_regex.fullmatch(cell.strip()):
-                week_day = cell.strip()
-                # find merge covering anchor
-                anchor = next((mr for mr in merge_ranges
-                               if mr['row'] <= i+1 <= mr['row'] + mr['num_rows'] - 1
-                               and mr['col'] <= j+1 <= mr['col'] + mr['num_cols'] - 1), None)
-                if anchor:
-                    sr = anchor['row']
-                    sc = anchor['col']
-                    height = anchor['num_rows']
-                else:
-                    sr = i+1
-                    sc = j+1
-                    height = 1
-
-                # 4) Locate "Exercise" header
-                ex_col = None
-                for mr in merge_ranges:
-                    top = mr['row']
-                    bot = top + mr['num_rows'] - 1
-                    if top <= sr <= bot and mr['col'] > sc:
-                        if values[top-1][mr['col']-1].strip() == 'Exercise':
-                            ex_col = mr['col']
-                            break
-                if ex_col is None:
-                    for c in range(sc, len(values[0])):
-                        if values[sr-1][c].strip() == 'Exercise':
-                            ex_col = c + 1
-                            break
-                if ex_col is None:
-                    raise ValueError(f"Could not find 'Exercise' for {week_day}")
-
-                # 5) Locate "Notes" header
-                notes_col = None
-                for mr in merge_ranges:
-                    r_idx = mr['row'] - 1
-                    c_idx = mr['col'] - 1
-                    if mr['col'] > sc and r_idx < len(values) and c_idx < len(values[r_idx]):
-                        if values[r_idx][c_idx].strip() == 'Notes':
-                            notes_col = mr['col']
-                            break
-                if notes_col is None:
-                    for c in range(len(values[0]) - 1, sc - 1, -1):
-                        if c < len(values[sr-1]) and values[sr-1][c].strip() == 'Notes':
-                            notes_col = c + 1
-                            break
-                if notes_col is None:
-                    raise ValueError(f"Could not find 'Notes' for {week_day}")
-
-                # 6) Prep data rows (skip two header lines) (skip two header lines)
-                data_rows = []
-                start_idx = sr - 1 + 2
-                end_idx = sr - 1 + height
-                for r in range(start_idx, end_idx):
-                    if r < len(values):
-                        data_rows.append(values[r])
-
-                # 7) Build spans to backfill exercise names
-                spans = []
-                for mr in merge_ranges:
-                    if mr['col'] == ex_col and mr['row'] <= sr + height - 1 and (mr['row'] + mr['num_rows'] - 1) >= sr + 2:
-                        row_idx = mr['row'] - 1
-                        col_idx = ex_col - 1
-                        # guard against out-of-bounds
-                        if row_idx < len(values) and col_idx < len(values[row_idx]):
-                            name = values[row_idx][col_idx].strip()
-                        else:
-                            name = ''
-                        if name:
-                            spans.append({'name': name, 'from': mr['row'], 'to': mr['row'] + mr['num_rows'] - 1})
-
-                # 8) Extract sets) Extract sets
-                prev_ex = None
-                counter = 1
-                for idx, row_vals in enumerate(data_rows):
-                    abs_row = sr + 2 + idx
-                    ex = row_vals[ex_col-1].strip()
-                    if not ex:
-                        for span in spans:
-                            if span['from'] <= abs_row <= span['to']:
-                                ex = span['name']
-                                break
-                    # collect metrics
-                    metrics = {}
-                    for key, offset in OFFSETS.items():
-                        col_idx = ex_col - 1 + offset
-                        metrics[key] = row_vals[col_idx] if col_idx < len(row_vals) else ''
-                    notes = row_vals[notes_col-1] if notes_col-1 < len(row_vals) else ''
-                    # skip blank rows
-                    if not any(str(v).strip() for v in list(metrics.values()) + [notes]):
-                        continue
-                    # reset counter on new exercise
-                    if ex != prev_ex:
-                        counter = 1
-                        prev_ex = ex
-                    results.append({
-                        'week_day': week_day,
-                        'exercise': ex,
-                        'set_number': counter,
-                        **metrics,
-                        'notes': notes
-                    })
-                    counter += 1
+        # one C-level scan per row instead of a regex call per cell
+        joined = CELL_SEP.join(row)
+        for m in week_day_regex.finditer(joined):
+            week_day = m.group()
+            j = joined.count(CELL_SEP, 0, m.start())
+            # find merge covering anchor
+            anchor = cell_to_merge.get((i+1, j+1))
+            if anchor:
+                sr = anchor['row']
+                sc = anchor['col']
+                height = anchor['num_rows']
+            else:
+                sr = i+1
+                sc = j+1
+                height = 1
+
+            cols = header_cols.get(sr)
+            if cols is None:
+                cols = header_cols[sr] = defaultdict(list)
+                for c, v in enumerate(values[sr-1]):
+                    cols[v].append(c)
+
+            # 4) Locate "Exercise" header
+            ex_col = next((mr['col'] for mr in merges_by_label['Exercise']
+                           if mr['row'] <= sr <= mr['row'] + mr['num_rows'] - 1
+                           and mr['col'] > sc), None)
+            if ex_col is None:
+                ex_col = next((c + 1 for c in cols['Exercise'] if c >= sc), None)
+            if ex_col is None:
+                raise ValueError(f"Could not find 'Exercise' for {week_day}")
+
+            # 5) Locate "Notes" header
+            notes_col = next((mr['col'] for mr in merges_by_label['Notes']
+                              if mr['col'] > sc), None)
+            if notes_col is None:
+                notes_col = next((c + 1 for c in reversed(cols['Notes']) if c >= sc), None)
+            if notes_col is None:
+                raise ValueError(f"Could not find 'Notes' for {week_day}")
+
+            # 6) Prep data rows (skip two header lines)
+            data_rows = values[sr - 1 + 2:sr - 1 + height]
+
+            # 7) Map each data row to the merged exercise name covering it
+            row_to_name = {}
+            for mr in merges_by_col[ex_col]:
+                if mr['row'] <= sr + height - 1 and (mr['row'] + mr['num_rows'] - 1) >= sr + 2:
+                    row_idx = mr['row'] - 1
+                    col_idx = ex_col - 1
+                    # guard against out-of-bounds
+                    if row_idx < len(values) and col_idx < len(values[row_idx]):
+                        name = values[row_idx][col_idx]
+                    else:
+                        name = ''
+                    if name:
+                        first = max(mr['row'], sr + 2)
+                        last = min(mr['row'] + mr['num_rows'] - 1, sr + height - 1)
+                        for r in range(first, last + 1):
+                            row_to_name.setdefault(r, name)
+
+            # 8) Extract sets
+            # column indexes are fixed per anchor, so resolve them once
+            metric_cols = [(key, ex_col - 1 + offset) for key, offset in OFFSETS.items()]
+            notes_idx = notes_col - 1
+            prev_ex = None
+            counter = 1
+            for idx, row_vals in enumerate(data_rows):
+                abs_row = sr + 2 + idx
+                ex = row_vals[ex_col-1]
+                if not ex:
+                    ex = row_to_name.get(abs_row, '')
+                # collect metrics
+                n_cols = len(row_vals)
+                metrics = {key: row_vals[c] if c < n_cols else '' for key, c in metric_cols}
+                notes = row_vals[notes_idx] if notes_idx < n_cols else ''
+                # skip blank rows
+                if not (notes or any(metrics.values())):
+                    continue
+                # reset counter on new exercise
+                if ex != prev_ex:
+                    counter = 1
+                    prev_ex = ex
+                results.append({
+                    'week_day': week_day,
+                    'exercise': ex,
+                    'set_number': counter,
+                    **metrics,
+                    'notes': notes
+                })
+                counter += 1
 
     return results
@@ -2,8 +2,10 @@
 import os
 import re
 import sys
+import time
 import logging
-import pandas as pd
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
 from psycopg2.extras import execute_values
 
@@ -21,6 +23,9 @@ logging.debug("=== Starting ETL run ===")
 # Default bodyweight for BW entries (kg)
 DEFAULT_BODYWEIGHT = float(os.getenv('DEFAULT_BODYWEIGHT', '100'))
 
+# Concurrent Google Sheets fetches (kept low to stay within the API quota)
+SHEETS_FETCH_WORKERS = int(os.getenv('SHEETS_FETCH_WORKERS', '4'))
+
 try:
     import gspread
 except ImportError:
@@ -37,6 +42,9 @@ BLOCK_SHEET_REGEX = re.compile(
     re.IGNORECASE
 )
 
+# Leading number of a range like "8-12"
+_RANGE_RE = re.compile(r'(\d+)\s*-\s*\d+')
+
 # Helper: parse numeric cell, handling ranges, BW, and percent adjustments
 def parse_numeric_cell(raw, previous_rpe=None):
     s = str(raw).strip()
@@ -45,10 +53,10 @@ def parse_numeric_cell(raw, previous_rpe=None):
         return None
 
     # 2) RPE‐percent adjustments
-    if s.endswith('%'):
+    if s[-1] == '%':
         if previous_rpe is None:
             return None  # or choose a sensible default
-        pct = float(s.rstrip('%'))
+        pct = float(s[:-1])
         if abs(pct) >= 7:
             return previous_rpe - 2
         elif abs(pct) >= 5:
@@ -57,12 +65,12 @@ def parse_numeric_cell(raw, previous_rpe=None):
             return previous_rpe
 
     # 3) Range like “8-12”
-    m = re.match(r'^(\d+)\s*-\s*\d+', s)
+    m = _RANGE_RE.match(s)
     if m:
         return float(m.group(1))
 
     # 4) Body-weight placeholder
-    if s.upper() == 'BW':
+    if s == 'BW' or s.upper() == 'BW':
         return DEFAULT_BODYWEIGHT
 
     # 5) Fallback
@@ -74,14 +82,14 @@ def parse_numeric_cell(raw, previous_rpe=None):
 # --------------------------------------------------------------------------------
 # 1) Find metadata: Start Date and End Date
 # --------------------------------------------------------------------------------
-def find_metadata(df):
+def find_metadata(values):
     start_date = None
     end_date   = None
-    for _, row in df.iterrows():
+    for row in values:
         for cell in row:
-            if isinstance(cell, str) and cell.startswith('Start Date:'):
+            if cell.startswith('Start Date:'):
                 start_date = cell.split(':', 1)[1].strip() or None
-            if isinstance(cell, str) and cell.startswith('End Date:'):
+            if cell.startswith('End Date:'):
                 end_date = cell.split(':', 1)[1].strip() or None
         if start_date or end_date:
             break
@@ -116,11 +124,34 @@ def get_block_sheets():
 
     return sorted(block_sheets, key=lambda x: x[0])
 
+
+def fetch_with_backoff(fn, retries=5, delay=1.0):
+    """
+    Call a Sheets API function, retrying with exponential backoff when the
+    request is rejected with HTTP 429 (quota exceeded).
+    """
+    for attempt in range(retries):
+        try:
+            return fn()
+        except gspread.exceptions.APIError as e:
+            if e.response.status_code != 429 or attempt == retries - 1:
+                raise
+            logging.warning(f"Sheets quota exceeded, retrying in {delay:.0f}s")
+            time.sleep(delay)
+            delay *= 2
+
+
+def fetch_block_values(block_sheets):
+    """
+    Fetch the cell values of every block worksheet concurrently.
+    Returns a list of `get_all_values()` results in `block_sheets` order.
+    """
+    with ThreadPoolExecutor(max_workers=SHEETS_FETCH_WORKERS) as pool:
+        return list(pool.map(lambda b: fetch_with_backoff(b[2].get_all_values), block_sheets))
+
 # --------------------------------------------------------------------------------
 # 3) DB helpers: upsert and insert
 # --------------------------------------------------------------------------------
-# (upsert_block, upsert_day, upsert_exercise, link_day_exercise, insert_sets unchanged)
-
 def upsert_block(cur, block_num, comment=None, start_date=None, end_date=None):
     name = f"Block {block_num}"
     cur.execute(
@@ -141,82 +172,102 @@ def upsert_block(cur, block_num, comment=None, start_date=None, end_date=None):
     return cur.fetchone()[0]
 
 
-def upsert_day(cur, block_id, day_number):
-    cur.execute(
+def upsert_days(cur, block_id, day_numbers):
+    """
+    Insert any missing days for a block and read back every id in a
+    single statement. Returns a {day_number: day_id} mapping.
+    """
+    day_numbers = list(dict.fromkeys(day_numbers))
+    if not day_numbers:
+        return {}
+    rows = execute_values(
+        cur,
         """
-        INSERT INTO training_days (block_id, day_number)
-        VALUES (%s, %s)
-        ON CONFLICT (block_id, day_number) DO NOTHING
-        RETURNING day_id
-        """, (block_id, day_number)
-    )
-    row = cur.fetchone()
-    if row:
-        return row[0]
-    cur.execute(
-        "SELECT day_id FROM training_days WHERE block_id = %s AND day_number = %s",
-        (block_id, day_number)
+        WITH v (block_id, day_number) AS (VALUES %s),
+        ins AS (
+            INSERT INTO training_days (block_id, day_number)
+            SELECT block_id, day_number FROM v
+            ON CONFLICT (block_id, day_number) DO NOTHING
+            RETURNING day_number, day_id
+        )
+        SELECT day_number, day_id FROM ins
+        UNION ALL
+        SELECT d.day_number, d.day_id
+        FROM training_days d JOIN v USING (block_id, day_number)
+        """, [(block_id, n) for n in day_numbers], fetch=True
     )
-    return cur.fetchone()[0]
+    return dict(rows)
 
 
-def upsert_exercise(cur, name):
-    cur.execute(
+def upsert_exercises(cur, names):
+    """
+    Insert any missing exercises and read back every id in a single
+    statement. Returns a {name: exercise_id} mapping.
+    """
+    names = list(dict.fromkeys(names))
+    if not names:
+        return {}
+    rows = execute_values(
+        cur,
         """
-        INSERT INTO exercises (name)
-        VALUES (%s)
-        ON CONFLICT (name) DO NOTHING
-        RETURNING exercise_id
-        """, (name,)
+        WITH v (name) AS (VALUES %s),
+        ins AS (
+            INSERT INTO exercises (name)
+            SELECT name FROM v
+            ON CONFLICT (name) DO NOTHING
+            RETURNING name, exercise_id
+        )
+        SELECT name, exercise_id FROM ins
+        UNION ALL
+        SELECT e.name, e.exercise_id
+        FROM exercises e JOIN v USING (name)
+        """, [(n,) for n in names], fetch=True
     )
-    row = cur.fetchone()
-    if row:
-        return row[0]
-    cur.execute("SELECT exercise_id FROM exercises WHERE name = %s", (name,))
-    return cur.fetchone()[0]
+    return dict(rows)
 
 
-def link_day_exercise(cur, day_id, exercise_id, order):
-    cur.execute(
+def link_day_exercises(cur, links):
+    """
+    Insert (day_id, exercise_id, order) links and read back every id in a
+    single statement; the first link wins for a repeated (day_id, order)
+    pair. Returns a {(day_id, order): day_exercise_id} mapping.
+    """
+    unique = {}
+    for day_id, exercise_id, order in links:
+        unique.setdefault((day_id, order), exercise_id)
+    if not unique:
+        return {}
+    rows = execute_values(
+        cur,
         """
-        INSERT INTO day_exercises (day_id, exercise_id, exercise_order)
-        VALUES (%s, %s, %s)
-        ON CONFLICT (day_id, exercise_order) DO NOTHING
-        RETURNING day_exercise_id
-        """, (day_id, exercise_id, order)
-    )
-    row = cur.fetchone()
-    if row:
-        return row[0]
-    cur.execute(
-        "SELECT day_exercise_id FROM day_exercises WHERE day_id = %s AND exercise_order = %s",
-        (day_id, order)
+        WITH v (day_id, exercise_id, exercise_order) AS (VALUES %s),
+        ins AS (
+            INSERT INTO day_exercises (day_id, exercise_id, exercise_order)
+            SELECT day_id, exercise_id, exercise_order FROM v
+            ON CONFLICT (day_id, exercise_order) DO NOTHING
+            RETURNING day_id, exercise_order, day_exercise_id
+        )
+        SELECT day_id, exercise_order, day_exercise_id FROM ins
+        UNION ALL
+        SELECT de.day_id, de.exercise_order, de.day_exercise_id
+        FROM day_exercises de JOIN v USING (day_id, exercise_order)
+        """, [(d, e, o) for (d, o), e in unique.items()], fetch=True
     )
-    return cur.fetchone()[0]
+    return {(d, o): de_id for d, o, de_id in rows}
 
 
-def insert_sets(cur, day_exercise_id, sets_list):
+def insert_sets(cur, records):
     """
-    Bulk-insert all sets for a given day_exercise_id, skipping any
+    Bulk-insert a batch of set records, skipping any
     (day_exercise_id, set_number) pairs that already exist.
+    Each record is a tuple in column order:
+    (day_exercise_id, set_number, prescribed_reps, prescribed_rpe,
+     completed_weight, completed_reps, completed_rpe).
     Returns the number of rows actually inserted.
     """
-    if not sets_list:
+    if not records:
         return 0
 
-    records = [
-        (
-            day_exercise_id,
-            s['set_number'],
-            s.get('prescribed_reps'),
-            s.get('prescribed_rpe'),
-            s.get('completed_weight'),
-            s.get('completed_reps'),
-            s.get('completed_rpe'),
-        )
-        for s in sets_list
-    ]
-
     sql = """
     INSERT INTO exercise_sets
       (day_exercise_id, set_number, prescribed_reps, prescribed_rpe,
@@ -225,7 +276,7 @@ def insert_sets(cur, day_exercise_id, sets_list):
     ON CONFLICT (day_exercise_id, set_number) DO NOTHING
     """
 
-    execute_values(cur, sql, records)
+    execute_values(cur, sql, records, page_size=1000)
     # cur.rowcount will be the number of rows inserted (conflicts are ignored)
     return cur.rowcount
 
@@ -242,76 +293,82 @@ def main():
     conn.autocommit = False
     cur = conn.cursor()
 
-    for block_num, comment, ws in get_block_sheets():
-        # Pull block‐level metadata once
-        df = pd.DataFrame(ws.get_all_values())
-        start_date, end_date = find_metadata(df)
+    block_sheets = get_block_sheets()
+
+    # Merge metadata covers the whole spreadsheet, so one fetch serves every block
+    metadata = (fetch_with_backoff(block_sheets[0][2].spreadsheet.fetch_sheet_metadata)
+                if block_sheets else None)
+
+    # Fetch every block's cell values up front; reused for metadata and extraction
+    block_values = fetch_block_values(block_sheets)
+
+    for (block_num, comment, ws), values in zip(block_sheets, block_values):
+        start_date, end_date = find_metadata(values)
 
         # Grab all the rows for the block in one go
-        rows = extract_all_workout_data(ws)
+        rows = extract_all_workout_data(ws, values, metadata)
         if not rows:
             print(f"No data found in Block {block_num}, skipping.")
             continue
 
-        # Upsert block header once
-        blk_id = upsert_block(cur, block_num, comment, start_date, end_date)
-        print(f"Block {block_num}: metadata upserted (ID={blk_id})")
-
-        # OPTIONAL: clear out any old days/sets for this block to avoid duplicates
-        cur.execute("""
-            DELETE FROM exercise_sets
-            WHERE day_exercise_id IN (
-            SELECT day_exercise_id FROM day_exercises
-                WHERE day_id IN (
-                SELECT day_id FROM training_days WHERE block_id = %s
-                )
-            )""", (blk_id,))
-        cur.execute("DELETE FROM day_exercises WHERE day_id IN (SELECT day_id FROM training_days WHERE block_id = %s)", (blk_id,))
-        cur.execute("DELETE FROM training_days WHERE block_id = %s", (blk_id,))
-
-        # Group rows by week_day
-        from collections import defaultdict
-        days = defaultdict(list)
-        for r in rows:
-            days[r['week_day']].append(r)
-
-        # Process each day as its own transaction
-        for week_day, day_rows in days.items():
-            try:
-                # Start a sub‐transaction
+        # Load the whole block as one transaction: a half-loaded block is
+        # worse than none, and one commit means one WAL flush per block
+        try:
+            # Upsert block header once
+            blk_id = upsert_block(cur, block_num, comment, start_date, end_date)
+            print(f"Block {block_num}: metadata upserted (ID={blk_id})")
+
+            # OPTIONAL: clear out any old days/sets for this block to avoid duplicates
+            # (day_exercises and exercise_sets follow via ON DELETE CASCADE)
+            cur.execute("DELETE FROM training_days WHERE block_id = %s", (blk_id,))
+
+            # Group rows by week_day
+            days = defaultdict(list)
+            for r in rows:
+                days[r['week_day']].append(r)
+
+            # Resolve every day, exercise and day/exercise link for the block up front
+            day_numbers = {wd: int(re.search(r'D(\d+)', wd).group(1)) for wd in days}
+            day_ids = upsert_days(cur, blk_id, day_numbers.values())
+            exercise_ids = upsert_exercises(cur, (r['exercise'] for r in rows))
+
+            # Track exercise order per day
+            exercise_orders = {}
+            links = []
+            for week_day, day_rows in days.items():
+                order = exercise_orders[week_day] = {}
+                for r in day_rows:
+                    order.setdefault(r['exercise'], len(order) + 1)
+                day_id = day_ids[day_numbers[week_day]]
+                links.extend((day_id, exercise_ids[ex], o) for ex, o in order.items())
+            day_exercise_ids = link_day_exercises(cur, links)
+
+            # Build one record per set, in exercise_sets column order
+            records = []
+            for week_day, day_rows in days.items():
                 logging.info(f"  → Processing {week_day}")
-                # Upsert the day
-                day_num = int(re.search(r'D(\d+)', week_day).group(1))
-                day_id = upsert_day(cur, blk_id, day_num)
-
-                # Track exercise order per day
-                exercise_order = {}
+                day_id = day_ids[day_numbers[week_day]]
+                exercise_order = exercise_orders[week_day]
                 for r in day_rows:
-                    ex = r['exercise']
-                    if ex not in exercise_order:
-                        exercise_order[ex] = len(exercise_order) + 1
-                    order = exercise_order[ex]
-
-                    ex_id = upsert_exercise(cur, ex)
-                    de_id = link_day_exercise(cur, day_id, ex_id, order)
-
-                    # Insert all sets for this exercise
-                    for s in r.get('sets', [r]):
-                        # if your row dict already has metrics, wrap them in a list named 'sets'
-                        insert_sets(cur, de_id, [dict(
-                            set_number    = s['set_number'],
-                            prescribed_reps   = parse_numeric_cell(s['prescribed_reps']),
-                            prescribed_rpe    = parse_numeric_cell(s['prescribed_rpe']),
-                            completed_weight  = parse_numeric_cell(s['completed_weight']),
-                            completed_reps    = parse_numeric_cell(s['completed_reps']),
-                            completed_rpe     = parse_numeric_cell(s['completed_rpe']),
-                        )])
-                conn.commit()
-                print(f"  ✔ {week_day} committed")
-            except Exception as e:
-                conn.rollback()
-                logging.error(f"  ✖ {week_day} failed: {e}")
-                print(f"  ✖ {week_day} failed: {e}")
+                    records.append((
+                        day_exercise_ids[(day_id, exercise_order[r['exercise']])],
+                        r['set_number'],
+                        parse_numeric_cell(r['prescribed_reps']),
+                        parse_numeric_cell(r['prescribed_rpe']),
+                        parse_numeric_cell(r['completed_weight']),
+                        parse_numeric_cell(r['completed_reps']),
+                        parse_numeric_cell(r['completed_rpe']),
+                    ))
+
+            # Insert every set for the block in a single batch
+            insert_sets(cur, records)
+
+            conn.commit()
+            print(f"  ✔ Block {block_num} committed")
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"  ✖ Block {block_num} failed: {e}")
+            print(f"  ✖ Block {block_num} failed: {e}")
 
     cur.close()
     conn.close()